@@ -95,7 +95,11 @@ async def process_group(group_id, s3_items, stop_event, temp_dir, bucket_name, s
         assert len(download_paths) == len(s3_items)
         assert all(not p.exists() for p in download_paths)
         await process_queue([
-            partial(s3_client_wrapper.download_file, bucket_name, s3_item['Key'], dp)
+            partial(
+                s3_client_wrapper.download_file,
+                bucket_name, s3_item['Key'], dp,
+                size=s3_item.get('Size'),
+                etag=s3_item.get('ETag'))
             for s3_item, dp in zip(s3_items, download_paths)
         ])
         with gzip.open(result_path, mode='wb') as f_res:
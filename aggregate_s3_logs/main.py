@@ -24,6 +24,7 @@ def aggregate_s3_logs_main():
     p.add_argument('--temp-dir')
     p.add_argument('--force', '-f', action='store_true', default=False)
     p.add_argument('--min-age', '-m', metavar='DAYS', type=int, default=1, help='do not process files recent than N days (default: 1)')
+    p.add_argument('--ranged-download-threshold', metavar='MB', type=int, default=32, help='download objects larger than N MB using parallel Range requests (default: 32)')
     p.add_argument('s3_url')
     args = p.parse_args()
     setup_logging(verbose=args.verbose)
@@ -42,13 +43,14 @@ def aggregate_s3_logs_main():
                 temp_dir=Path(temp_dir),
                 min_age_days=args.min_age,
                 force=args.force,
+                ranged_download_threshold_mb=args.ranged_download_threshold,
             ))
     except Exception as e:
         logger.exception('Failed: %r', e)
         sys.exit(repr(e))
 
 
-async def async_main(bucket_name, prefix, temp_dir, min_age_days, force):
+async def async_main(bucket_name, prefix, temp_dir, min_age_days, force, ranged_download_threshold_mb):
     stop_event = Event()
     loop = get_running_loop()
     loop.add_signal_handler(SIGTERM, lambda: stop_event.set())
@@ -60,7 +62,7 @@ async def async_main(bucket_name, prefix, temp_dir, min_age_days, force):
         min_age_days=min_age_days,
         force=force,
         stop_event=stop_event,
-        s3_client_wrapper=S3ClientWrapper())
+        s3_client_wrapper=S3ClientWrapper(ranged_download_threshold=ranged_download_threshold_mb * 2**20))
 
 
 def parse_s3_url(s3_url):
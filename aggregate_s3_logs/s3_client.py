@@ -1,6 +1,9 @@
-from asyncio import Semaphore
+from asyncio import Semaphore, gather
 import boto3
+from botocore.exceptions import ClientError
+import hashlib
 from logging import getLogger
+import os
 from pathlib import Path
 from pprint import pformat
 from shutil import copyfileobj
@@ -38,8 +41,12 @@ class S3ClientWrapper:
 
     max_concurrent_downloads = 16
     max_concurrent_uploads = 16
+    ranged_download_threshold = 32 * 2**20
+    ranged_download_part_size = 8 * 2**20
 
-    def __init__(self):
+    def __init__(self, ranged_download_threshold=None):
+        if ranged_download_threshold is not None:
+            self.ranged_download_threshold = ranged_download_threshold
         self._download_sem = SemaphoreWrapper(self.max_concurrent_downloads)
         self._upload_sem = SemaphoreWrapper(self.max_concurrent_uploads)
 
@@ -64,7 +71,9 @@ class S3ClientWrapper:
             del contents
         return items
 
-    async def download_file(self, bucket_name, key, download_path):
+    async def download_file(self, bucket_name, key, download_path, size=None, etag=None):
+        if size is not None and size > self.ranged_download_threshold:
+            return await self._download_file_ranged(bucket_name, key, download_path, size, etag)
         async with self._download_sem:
             return await run_in_thread(self._download_file_sync, bucket_name, key, download_path)
 
@@ -78,6 +87,98 @@ class S3ClientWrapper:
         with download_path.open(mode='wb') as f:
             copyfileobj(res['Body'], f)
 
+    async def _download_file_ranged(self, bucket_name, key, download_path, size, etag):
+        '''
+        Download large object as several concurrent Range GETs.
+
+        Each part takes its own slot in the download semaphore and is written
+        with pwrite at its offset into a preallocated file.
+        '''
+        assert isinstance(download_path, Path)
+        assert isinstance(size, int)
+        ranges = split_byte_ranges(size, self.ranged_download_part_size)
+        logger.debug(
+            'Downloading %s %s (%.2f MB) to %s in %d parts',
+            bucket_name, key, size / 2**20, download_path, len(ranges))
+        with download_path.open(mode='wb') as f:
+            f.truncate(size)
+        # Each part opens its own fd, so threads that outlive a cancelled
+        # gather can only ever write into download_path.
+        results = await gather(*[
+            self._download_range(bucket_name, key, etag, download_path, start, end)
+            for start, end in ranges
+        ], return_exceptions=True)
+        for res in results:
+            if isinstance(res, BaseException):
+                raise res
+        await run_in_thread(check_downloaded_file_sync, key, download_path, size, etag, results)
+
+    async def _download_range(self, bucket_name, key, etag, download_path, start, end):
+        async with self._download_sem:
+            return await run_in_thread(self._download_range_sync, bucket_name, key, etag, download_path, start, end)
+
+    def _download_range_sync(self, bucket_name, key, etag, download_path, start, end):
+        '''
+        Returns dict with number of bytes written and encryption info from the response.
+        '''
+        assert isinstance(bucket_name, str)
+        assert isinstance(key, str)
+        assert isinstance(download_path, Path)
+        assert 0 <= start < end
+        s3_client = boto3.client('s3')
+        get_kwargs = {
+            'Bucket': bucket_name,
+            'Key': key,
+            'Range': 'bytes={}-{}'.format(start, end - 1),
+        }
+        if etag:
+            # make sure all parts come from the same version of the object
+            get_kwargs['IfMatch'] = etag
+        try_count = 0
+        while True:
+            try_count += 1
+            if try_count > 1:
+                logger.debug('Trying again to download %s %s range %d-%d', bucket_name, key, start, end - 1)
+            try:
+                res = s3_client.get_object(**get_kwargs)
+                pos = start
+                fd = os.open(str(download_path), os.O_WRONLY)
+                try:
+                    while True:
+                        chunk = res['Body'].read(65536)
+                        if chunk == b'':
+                            break
+                        if pos + len(chunk) > end:
+                            raise Exception('Range {}-{} of {} returned too much data'.format(start, end - 1, key))
+                        while chunk:
+                            written = os.pwrite(fd, chunk, pos)
+                            pos += written
+                            chunk = chunk[written:]
+                finally:
+                    os.close(fd)
+                if pos != end:
+                    raise Exception('Range {}-{} of {} is incomplete: got {} bytes'.format(
+                        start, end - 1, key, pos - start))
+                return {
+                    'length': pos - start,
+                    'ServerSideEncryption': res.get('ServerSideEncryption'),
+                    'SSECustomerAlgorithm': res.get('SSECustomerAlgorithm'),
+                }
+            except Exception as e:
+                if isinstance(e, ClientError) and e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 500) < 500:
+                    # 4xx (e.g. PreconditionFailed - object changed since listing) will not go away by retrying
+                    raise e
+                if isinstance(e, FileNotFoundError):
+                    # download_path was removed - the download was cancelled
+                    raise e
+                if try_count >= 5:
+                    raise e
+                sleep_duration = 1 + 2**try_count
+                logger.exception(
+                    'get_object %s range %d-%d failed: %r; trying again in %d s...',
+                    key, start, end - 1, e, sleep_duration)
+                sleep_sync(sleep_duration)
+
     async def upload_file(self, bucket_name, key, src_path, content_type):
         async with self._upload_sem:
             return await run_in_thread(self._upload_file_sync, bucket_name, key, src_path, content_type)
@@ -146,6 +247,38 @@ class S3ClientWrapper:
                 break
 
 
+def check_downloaded_file_sync(key, path, size, etag, part_results):
+    received_size = sum(r['length'] for r in part_results)
+    if received_size != size:
+        raise Exception('Received {} bytes of {}, expected {}'.format(received_size, key, size))
+    if not etag or '-' in etag.strip('"'):
+        # multipart upload ETag is not MD5 of the content
+        return
+    if any(r['SSECustomerAlgorithm'] for r in part_results):
+        return
+    if any(r['ServerSideEncryption'] not in (None, 'AES256') for r in part_results):
+        # ETag of SSE-KMS objects is not MD5 of the content either
+        return
+    h = hashlib.md5()
+    with path.open(mode='rb') as f:
+        while True:
+            chunk = f.read(65536)
+            if chunk == b'':
+                break
+            h.update(chunk)
+    if h.hexdigest() != etag.strip('"').lower():
+        raise Exception('Downloaded {} has MD5 {}, expected ETag {}'.format(key, h.hexdigest(), etag))
+
+
+def split_byte_ranges(size, part_size):
+    return [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+
+assert split_byte_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+assert split_byte_ranges(8, 4) == [(0, 4), (4, 8)]
+assert split_byte_ranges(0, 4) == []
+
+
 def split(items, chunk_size):
     chunks = []
     chunk = []
@@ -16,10 +16,14 @@ class DummyS3Wrapper:
         assert not Prefix.startswith('/')
         assert Bucket == 'b1'
         await sleep(0.01)
-        return [{'Key': k, 'StorageClass': 'STANDARD'} for k in sorted(self.files.keys()) if k.startswith(Prefix)]
+        return [
+            {'Key': k, 'Size': len(v), 'StorageClass': 'STANDARD'}
+            for k, v in sorted(self.files.items()) if k.startswith(Prefix)
+        ]
 
-    async def download_file(self, bucket_name, key, download_path):
+    async def download_file(self, bucket_name, key, download_path, size, etag):
         assert bucket_name == 'b1'
+        assert size == len(self.files[key])
         download_path.write_bytes(self.files[key])
         await sleep(0.01)
 
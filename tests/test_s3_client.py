@@ -0,0 +1,114 @@
+from botocore.exceptions import ClientError
+import hashlib
+from io import BytesIO
+from pytest import fixture, mark, raises
+
+from aggregate_s3_logs import s3_client
+from aggregate_s3_logs.s3_client import S3ClientWrapper, check_downloaded_file_sync
+
+
+sample_data = bytes(range(256)) * 100
+
+
+class DummyBotoClient:
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+        self.bad_responses = []
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        assert Bucket == 'b1'
+        assert Key == 'k1'
+        self.calls.append(Range)
+        if self.bad_responses:
+            return {'Body': BytesIO(self.bad_responses.pop(0))}
+        if Range is None:
+            return {'Body': BytesIO(self.data)}
+        assert Range.startswith('bytes=')
+        start, end = Range[len('bytes='):].split('-')
+        return {'Body': BytesIO(self.data[int(start):int(end) + 1])}
+
+
+@fixture
+def boto_client(monkeypatch):
+    client = DummyBotoClient(sample_data)
+    monkeypatch.setattr(s3_client.boto3, 'client', lambda service_name: client)
+    monkeypatch.setattr(s3_client, 'sleep_sync', lambda duration: None)
+    return client
+
+
+@fixture
+def s3_client_wrapper():
+    w = S3ClientWrapper(ranged_download_threshold=4000)
+    w.ranged_download_part_size = 1000
+    return w
+
+
+@mark.asyncio
+async def test_download_file_small_object_uses_single_get(boto_client, s3_client_wrapper, temp_dir):
+    dp = temp_dir / 'out'
+    await s3_client_wrapper.download_file('b1', 'k1', dp, size=4000, etag=None)
+    assert boto_client.calls == [None]
+    assert dp.read_bytes() == sample_data
+
+
+@mark.asyncio
+async def test_download_file_large_object_uses_ranges(boto_client, s3_client_wrapper, temp_dir):
+    dp = temp_dir / 'out'
+    etag = '"{}"'.format(hashlib.md5(sample_data).hexdigest())
+    await s3_client_wrapper.download_file('b1', 'k1', dp, size=len(sample_data), etag=etag)
+    assert len(boto_client.calls) == 26
+    assert sorted(boto_client.calls)[:2] == ['bytes=0-999', 'bytes=1000-1999']
+    assert 'bytes=25000-25599' in boto_client.calls
+    assert dp.read_bytes() == sample_data
+
+
+@mark.asyncio
+async def test_download_range_short_body_is_retried(boto_client, s3_client_wrapper, temp_dir):
+    dp = temp_dir / 'out'
+    dp.write_bytes(bytes(1000))
+    boto_client.bad_responses = [b'short']
+    res = s3_client_wrapper._download_range_sync('b1', 'k1', None, dp, 0, 1000)
+    assert res['length'] == 1000
+    assert len(boto_client.calls) == 2
+    assert dp.read_bytes() == sample_data[:1000]
+
+
+def test_download_range_oversized_body_fails(boto_client, s3_client_wrapper, temp_dir):
+    dp = temp_dir / 'out'
+    dp.write_bytes(bytes(1000))
+    boto_client.bad_responses = [bytes(1001)] * 5
+    with raises(Exception, match='returned too much data'):
+        s3_client_wrapper._download_range_sync('b1', 'k1', None, dp, 0, 1000)
+    assert len(boto_client.calls) == 5
+
+
+def test_download_range_precondition_failed_is_not_retried(boto_client, s3_client_wrapper, temp_dir, monkeypatch):
+    dp = temp_dir / 'out'
+    dp.write_bytes(bytes(1000))
+
+    def get_object(**kwargs):
+        boto_client.calls.append(kwargs['Range'])
+        raise ClientError(
+            {'Error': {'Code': 'PreconditionFailed'}, 'ResponseMetadata': {'HTTPStatusCode': 412}},
+            'GetObject')
+
+    monkeypatch.setattr(boto_client, 'get_object', get_object)
+    with raises(ClientError):
+        s3_client_wrapper._download_range_sync('b1', 'k1', '"abc"', dp, 0, 1000)
+    assert len(boto_client.calls) == 1
+
+
+def test_check_downloaded_file_rejects_md5_mismatch(temp_dir):
+    p = temp_dir / 'out'
+    p.write_bytes(b'hello')
+    parts = [{'length': 5, 'ServerSideEncryption': None, 'SSECustomerAlgorithm': None}]
+    check_downloaded_file_sync('k1', p, 5, '"{}"'.format(hashlib.md5(b'hello').hexdigest()), parts)
+    with raises(Exception, match='expected ETag'):
+        check_downloaded_file_sync('k1', p, 5, '"{}"'.format(hashlib.md5(b'other').hexdigest()), parts)
+    with raises(Exception, match='Received 5 bytes'):
+        check_downloaded_file_sync('k1', p, 6, None, parts)
+    # ETag of SSE-KMS objects is not MD5 of the content
+    kms_parts = [{'length': 5, 'ServerSideEncryption': 'aws:kms', 'SSECustomerAlgorithm': None}]
+    check_downloaded_file_sync('k1', p, 5, '"{}"'.format(hashlib.md5(b'other').hexdigest()), kms_parts)